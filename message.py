@@ -1,24 +1,314 @@
 
-from abc import ABC
+import asyncio
+import copyreg
+from functools import cached_property
+import itertools
 import pickle
+import queue
 import socket
+import struct
 import threading
-from typing import Any, ByteString, Dict, List, Tuple, Union
+import time
+from typing import Any, ByteString, Callable, Dict, List, Set, Tuple, Union
 import warnings
+import weakref
+import zlib
 
 import mcubes
 import numpy as np
 import open3d as o3d
 
+_IOV_MAX = 1024 # max number of buffers a single sendmsg accepts on Linux
 
-class BaseMessage(ABC):
+def _pack_frames(frames: List[Any]) -> List[memoryview]:
+    """ Prefix the frames with their count and lengths
+
+    Params
+    ------
+    frames: bytes-like objects, i.e. the pickled message followed
+        by its out-of-band buffers
+
+    Return
+    ------
+    memoryviews of the header and of each frame, ready for
+    `_send_frames`, which can be re-sent as many times as needed
+    """
+    views = [memoryview(frame) for frame in frames]
+    header = struct.pack(f'!I{len(views)}Q', len(views), *(view.nbytes for view in views))
+    return [memoryview(header), *views]
+
+def _send_frames(client: socket.socket, views: List[memoryview]) -> None:
+    """ Send the frames packed by `_pack_frames`
+
+    The frames are handed to the kernel with scatter-gather I/O
+    instead of being concatenated into one bytestring first. Short
+    writes are resumed from where the kernel stopped.
+
+    Params
+    ------
+    client: the connected socket
+    views: the packed frames, left unchanged
+    """
+    if not hasattr(client, 'sendmsg'):
+        # e.g. Windows
+        for view in views:
+            client.sendall(view)
+        return
+    while views:
+        sent = client.sendmsg(views[:_IOV_MAX])
+        done = 0
+        while done < len(views) and sent >= views[done].nbytes:
+            sent -= views[done].nbytes
+            done += 1
+        views = views[done:]
+        if sent:
+            views[0] = views[0][sent:]
+
+def _recv_exactly(client: socket.socket, buffer: bytearray) -> None:
+    """ Fill the whole `buffer` with the bytes read from `client`
+    """
+    with memoryview(buffer) as view:
+        received = 0
+        while received < len(view):
+            size = client.recv_into(view[received:])
+            if size == 0:
+                raise EOFError("connection closed by the peer")
+            received += size
+
+def _recv_frames(client: socket.socket) -> List[bytearray]:
+    """ Receive frames sent in the layout of `_send_frames`
+
+    Each frame is read in place into a bytearray of exactly its
+    length, however many TCP segments it arrives in.
+    """
+    header = bytearray(4)
+    _recv_exactly(client, header)
+    frame_num, = struct.unpack('!I', header)
+    frame_lens = bytearray(8 * frame_num)
+    _recv_exactly(client, frame_lens)
+    frames = []
+    for frame_len in struct.unpack(f'!{frame_num}Q', frame_lens):
+        frame = bytearray(frame_len)
+        _recv_exactly(client, frame)
+        frames.append(frame)
+    return frames
+
+def _contiguous(value: Any) -> Any:
+    """ A contiguous copy of `value` if it is a non-contiguous
+    np.ndarray, otherwise `value` itself
+    """
+    if isinstance(value, np.ndarray) and \
+        not (value.flags.c_contiguous or value.flags.f_contiguous):
+        return np.ascontiguousarray(value)
+    return value
+
+
+class _ConnectionPool:
+    """ A pool of the connections to the server, kept open across
+    messages, so that a message does not pay for a new TCP handshake
+
+    Params
+    ------
+    maxsize: at most how many idle connections are kept for each
+        server address, the extra ones are closed when released
+    """
+    SNDBUF_SIZE = 262144 # 256KB
+
+    def __init__(self, maxsize: int = 4) -> None:
+        self.maxsize = maxsize
+        self._idle: Dict[Tuple[str, int], queue.Queue] = {}
+        self._lock = threading.Lock()
+
+    def _idle_queue(self, address: Tuple[str, int]) -> queue.Queue:
+        idle = self._idle.get(address)
+        if idle is None:
+            with self._lock:
+                idle = self._idle.setdefault(address, queue.Queue(self.maxsize))
+        return idle
+
+    def acquire(self, address: Tuple[str, int]) -> Tuple[socket.socket, bool]:
+        """ Take an idle connection to `address`, or establish a new
+        one if there is none. Nagle's algorithm is disabled on new
+        connections, since most messages are small and wait for a
+        response.
+
+        Return
+        ------
+        the connection, and whether it is an idle one being reused
+        """
+        try:
+            return self._idle_queue(address).get_nowait(), True
+        except queue.Empty:
+            pass
+        client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            client.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, _ConnectionPool.SNDBUF_SIZE)
+            client.connect(address)
+        except OSError:
+            client.close()
+            raise
+        return client, False
+
+    def release(self, address: Tuple[str, int], client: socket.socket) -> None:
+        """ Put a healthy connection back, or close it if the pool
+        is full. A broken connection shall be closed instead.
+        """
+        try:
+            self._idle_queue(address).put_nowait(client)
+        except queue.Full:
+            client.close()
+
+    def clear(self, address: Tuple[str, int]) -> None:
+        """ Close all the idle connections to `address`, e.g. when
+        one of them is found broken as the server has restarted
+        """
+        idle = self._idle_queue(address)
+        while True:
+            try:
+                idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class _AsyncConnection:
+    """ A connection to the server for `BaseMessage.send_async`,
+    (re-)established on demand
+
+    Params
+    ------
+    address: the (ip, port) of the server
+    """
+    def __init__(self, address: Tuple[str, int]) -> None:
+        self.address = address
+        self._streams: Tuple[asyncio.StreamReader, asyncio.StreamWriter] = None
+
+    @property
+    def is_open(self) -> bool:
+        return self._streams is not None
+
+    async def exchange(self, requests: List[List[memoryview]]) -> List[Union[List[bytes], Exception]]:
+        """ Send the requests, each packed by `_pack_frames`, all at
+        once, then read their responses in order
+
+        The server answers the requests of a connection in the order
+        they are received, so the requests are pipelined rather than
+        waiting for the response of one before sending the next.
+
+        Return
+        ------
+        the frames of the response to each request, or the error the
+        connection failed with before the response was read, in which
+        case the connection is closed
+        """
+        responses: List[Union[List[bytes], Exception]] = []
+        try:
+            if self._streams is None:
+                # NOTE: asyncio disables Nagle's algorithm on TCP transports
+                self._streams = await asyncio.open_connection(*self.address)
+            reader, writer = self._streams
+            for views in requests:
+                for view in views:
+                    writer.write(view)
+            await writer.drain()
+            for _ in requests:
+                frame_num, = struct.unpack('!I', await reader.readexactly(4))
+                frame_lens = struct.unpack(f'!{frame_num}Q', await reader.readexactly(8 * frame_num))
+                responses.append([await reader.readexactly(frame_len) for frame_len in frame_lens])
+        except (OSError, EOFError) as e:
+            self.close()
+            responses += [e] * (len(requests) - len(responses))
+        return responses
+
+    def close(self) -> None:
+        if self._streams is not None:
+            self._streams[1].close()
+            self._streams = None
+
+
+class _AsyncConnectionPool:
+    """ The async counterpart of `_ConnectionPool`. The connections
+    are bound to the event loop they are opened in, so the idle ones
+    are kept per loop, and are closed when the tasks of the loop are
+    cancelled as it shuts down, e.g. at the end of `asyncio.run`
+
+    Params
+    ------
+    maxsize: at most how many idle connections are kept for each
+        server address in each loop
+    """
+    def __init__(self, maxsize: int = 4) -> None:
+        self.maxsize = maxsize
+        self._idle: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Tuple[str, int], List[_AsyncConnection]]]" = \
+            weakref.WeakKeyDictionary()
+        self._closers: Set[asyncio.Task] = set()
+        """ the event loop keeps only weak references to its tasks
+        """
+
+    def _idle_list(self, address: Tuple[str, int]) -> List[_AsyncConnection]:
+        loop = asyncio.get_running_loop()
+        idle = self._idle.get(loop)
+        if idle is None:
+            idle = self._idle[loop] = {}
+            closer = loop.create_task(_AsyncConnectionPool._close_at_shutdown(idle))
+            self._closers.add(closer)
+            closer.add_done_callback(self._closers.discard)
+        return idle.setdefault(address, [])
+
+    @staticmethod
+    async def _close_at_shutdown(idle: Dict[Tuple[str, int], List[_AsyncConnection]]) -> None:
+        try:
+            await asyncio.get_running_loop().create_future()
+        finally:
+            for connections in idle.values():
+                for connection in connections:
+                    connection.close()
+            idle.clear()
+
+    def acquire(self, address: Tuple[str, int]) -> _AsyncConnection:
+        """ Take an idle connection to `address`, or a new one, which
+        is opened on its first exchange
+        """
+        idle = self._idle_list(address)
+        return idle.pop() if idle else _AsyncConnection(address)
+
+    def release(self, connection: _AsyncConnection) -> None:
+        """ Put an open connection back, or close it if the pool is
+        full. A closed connection is simply dropped.
+        """
+        if not connection.is_open:
+            return
+        idle = self._idle_list(connection.address)
+        if len(idle) < self.maxsize:
+            idle.append(connection)
+        else:
+            connection.close()
+
+    def clear(self, address: Tuple[str, int]) -> None:
+        """ Close all the idle connections to `address` """
+        idle = self._idle_list(address)
+        while idle:
+            idle.pop().close()
+
+
+class BaseMessage:
     """ Base message for all the messages that
     can be exchanged through the protocol
     """
-    _message_cnt = 1
-    _cnt_lock = threading.RLock()
+    _message_counter = itertools.count(1)
     ip = 'localhost'
     port = 4490
+    _pool = _ConnectionPool()
+    _async_pool = _AsyncConnectionPool()
+    _fields: Tuple[str, ...] = ('message_idx',)
+    """ the attributes that make up the message on the wire, in order,
+    a subclass not declaring its own `_fields` is pickled by `__dict__`
+    """
+    CRITICAL = False
+    """ whether an error is raised if the message fails to be sent,
+    True for the messages adding something to the renderer
+    """
+
     def __init__(self) -> None:
         """ The super.init will assign a global
         unique id to each message.
@@ -28,85 +318,284 @@ class BaseMessage(ABC):
 
     def set_idx_and_increment_cnt(self) -> None:
         """ generate a global unique id for this message
+
+        This is thread-safe, as `next` on an itertools.count is
+        atomic under the GIL.
         """
-        BaseMessage._cnt_lock.acquire()
-        try:
-            self.message_idx = self._message_cnt
-            BaseMessage._message_cnt += 1
-        finally:
-            BaseMessage._cnt_lock.release()
+        self.message_idx = next(BaseMessage._message_counter)
+
+    def __reduce_ex__(self, protocol: int):
+        """ Pickle the declared `_fields` as a plain tuple
 
-    def _prepare_connection(self) -> socket.socket:
-        """ Establish a Ipv4 TCP connection to the server
+        Each message type has a fixed layout, so there is no need
+        to ship the attribute names along with every instance as
+        the default `__dict__` based state does.
+        """
+        if '_fields' not in vars(type(self)):
+            # the layout is unknown, keep every attribute
+            state = self.__dict__
+        else:
+            state = tuple(self._field_state(field, protocol) for field in self._fields)
+        return copyreg.__newobj__, (type(self),), state
+
+    def _field_state(self, field: str, protocol: int) -> Any:
+        """ The value of the attribute `field` as it is pickled
+        with `protocol`
+
+        NumPy pickles a non-contiguous array in-band, through an
+        intermediate bytes copy, so such arrays are made contiguous
+        here to be passed out-of-band like the others.
+        """
+        return _contiguous(getattr(self, field))
+
+    def __setstate__(self, state: Union[Tuple[Any, ...], Dict[str, Any]]) -> None:
+        if isinstance(state, dict):
+            self.__dict__.update(state)
+            return
+        if len(state) != len(self._fields):
+            raise pickle.UnpicklingError(f"{type(self).__name__} expects {len(self._fields)} fields, but got {len(state)}")
+        for field, value in zip(self._fields, state):
+            setattr(self, field, value)
+
+    def _prepare_connection(self) -> Tuple[socket.socket, bool]:
+        """ Get an Ipv4 TCP connection to the server from the pool
 
         Return
         ------
-        the socket connection
+        the socket connection, and whether it is a kept one being
+        reused
         """
-        client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        client.connect((self.ip, self.port))
-        return client
+        return BaseMessage._pool.acquire((self.ip, self.port))
 
-    def send(self, retry_times = 0):
-        """ Send the message
+    def _release_connection(self, client: socket.socket) -> None:
+        """ Return the connection to the pool after a successful
+        request, so that it serves the following messages
+        """
+        BaseMessage._pool.release((self.ip, self.port), client)
 
-        If the connection is not established, first establish the
-        connection and then send the message.
-        If the message sending fails, retry the sending until the 
-        retry_times == 3. If the message still cannot be sent when
-        retry_times == 3, a error will be raised if the message
-        is critical (those adding something to the renderer), or
-        the message will simply be discarded.
+    MAX_RETRY_TIMES = 3
 
-        Params
-        ------
-        retry_times: retry times, if this parameter >= 2, no
-            retry if the sending fails
+    def _pack(self) -> List[memoryview]:
+        """ Pickle the message into the frames to be sent
+
+        NOTE: with protocol 5, large contiguous payloads (numpy arrays,
+        mesh files) are not copied into the pickle stream but passed
+        to `buffers`, and are sent as separate frames. The message is
+        pickled and packed only once, the same frames are re-sent on
+        retry.
         """
-        client = self._prepare_connection()
-        
-        # send & receive
-        bin_data = pickle.dumps(self)
-        client.sendall(bin_data)
-        bstr = client.recv(1024)
-        response = pickle.loads(bstr)
-        # error handling
-        if not isinstance(response, ResponseMessage):
-            error_reason = "corrupted response"
+        buffers: List[pickle.PickleBuffer] = []
+        bin_data = pickle.dumps(self, protocol=5, buffer_callback=buffers.append)
+        return _pack_frames([bin_data, *(buffer.raw() for buffer in buffers)])
+
+    def _check_response(self, response: Union["ResponseMessage", Exception]) -> str:
+        """ Return the reason why the sending failed, or an empty
+        string if the `response` acknowledges this message
+        """
+        if isinstance(response, Exception):
+            return f"connection broken ({response!r})"
+        elif not isinstance(response, ResponseMessage):
+            return "corrupted response"
         elif response.message_idx != self.message_idx:
-            error_reason = f"REQ_IDX={self.message_idx}, RES_IDX={response.message_idx}"
+            return f"REQ_IDX={self.message_idx}, RES_IDX={response.message_idx}"
         else:
-            error_reason = response.err_msg
+            return response.err_msg
 
-        if len(error_reason) == 0:
-            # succeed
-            client.close()
-        
-        elif retry_times < 3:
-            # failed, re-try 
+    def _retry_range(self, retry_times: int) -> range:
+        return range(retry_times, max(retry_times, BaseMessage.MAX_RETRY_TIMES) + 1)
+
+    @staticmethod
+    def _backoff(attempt: int) -> float:
+        """ seconds to wait before the `attempt` """
+        return min(0.005 * (1 << attempt), 0.1)
+
+    def _warn_retry(self, attempt: int, error_reason: str) -> None:
+        if attempt < BaseMessage.MAX_RETRY_TIMES:
             warnings.warn(f"message {self.message_idx} of type {type(self)} failed because " + \
                 error_reason + ". Retrying.")
-            client.close()
-            self.send(retry_times + 1) # retry
-        
-        # fail for 3 times: 
-        elif isinstance(self, MeshesMessage) or \
-            isinstance(self, AddRigidBodyPrimitiveMessage):
-            client.close()
+
+    def _give_up(self, error_reason: str) -> None:
+        """ Called when the sending failed for MAX_RETRY_TIMES + 1 times
+        """
+        if self.CRITICAL:
             raise Exception("critical message failed to be sent, because " + error_reason)
         else:
-            client.close()
             warnings.warn(f"message {self.message_idx} of type {type(self)} failed again because " + \
                 error_reason + ". Won't retry")
 
+    def send(self, retry_times = 0):
+        """ Send the message
+
+        The message is sent over a pooled connection, which is
+        kept open for the following messages.
+        If the message sending fails, retry the sending, with an
+        exponential backoff, until it has been retried for
+        MAX_RETRY_TIMES. If the message still cannot be sent, a
+        error will be raised if the message is critical (those
+        adding something to the renderer), or the message will
+        simply be discarded.
+
+        Params
+        ------
+        retry_times: how many times the sending has been retried,
+            if this parameter >= MAX_RETRY_TIMES, no retry if the
+            sending fails
+        """
+        frames = self._pack()
+        for attempt in self._retry_range(retry_times):
+            if attempt > retry_times:
+                time.sleep(self._backoff(attempt))
+            response = self._exchange(frames)
+            error_reason = self._check_response(response)
+            if len(error_reason) == 0:
+                return
+            self._warn_retry(attempt, error_reason)
+        self._give_up(error_reason)
+
+    def _exchange(self, frames: List[memoryview]) -> Union["ResponseMessage", Exception]:
+        """ Send the frames over a pooled connection and read the
+        response
+
+        A kept connection found broken, e.g. as the server restarted,
+        does not count as a failed attempt: the other idle connections
+        are stale as well, so they are all dropped, and the frames are
+        sent again right away over a new connection.
+
+        Return
+        ------
+        the response, or the error the connection failed with
+        """
+        while True:
+            client, reused = None, False
+            try:
+                client, reused = self._prepare_connection()
+                _send_frames(client, frames)
+                response = ResponseMessage.from_bytes(_recv_frames(client)[0])
+            except (OSError, EOFError) as e:
+                if client is not None:
+                    client.close()
+                if reused:
+                    BaseMessage._pool.clear((self.ip, self.port))
+                    continue
+                # the connection is refused, or broken while in use
+                return e
+            if len(self._check_response(response)) == 0:
+                # succeed, the connection is kept
+                self._release_connection(client)
+            else:
+                # failed, the connection might be out of sync, drop it
+                client.close()
+            return response
+
+    async def send_async(self, retry_times = 0, connection: "_AsyncConnection" = None):
+        """ The coroutine version of `send`
+
+        Params
+        ------
+        retry_times: the same as `send`
+        connection: the connection to send the message over, which
+            is left open afterwards; if None, a pooled connection is
+            used
+        """
+        await BaseMessage._send_lane([self], retry_times, connection)
+
+    @staticmethod
+    async def send_many(messages: List["BaseMessage"], connections: int = 4) -> None:
+        """ Send the messages concurrently, e.g. the poses of all the
+        objects in one frame, instead of waiting for the response of
+        each message before sending the next one
+
+        The messages are spread over at most `connections` pooled
+        connections. Over each of them, its share is sent all at
+        once before the responses are read.
+
+        NOTE: the messages may be received out of order, so messages
+        relying on each other, such as the MeshesMessage and the
+        UpdateRigidBodyPoseMessage of the same object, shall not be
+        sent in one call.
+
+        Params
+        ------
+        messages: the messages to be sent
+        connections: at most how many connections to use
+        """
+        lane_num = min(connections, len(messages))
+        await asyncio.gather(*(BaseMessage._send_lane(messages[i::lane_num]) for i in range(lane_num)))
+
+    @staticmethod
+    async def _send_lane(lane: List["BaseMessage"], retry_times = 0, connection: "_AsyncConnection" = None) -> None:
+        """ Send the messages pipelined over one connection, retrying
+        the failed ones together in the same way as `send`
+
+        Params
+        ------
+        lane: the messages, all to the same server
+        retry_times: the same as `send`
+        connection: the connection to send the messages over; if
+            None, a pooled connection is used
+        """
+        pending = [(message, message._pack()) for message in lane]
+        for attempt in lane[0]._retry_range(retry_times):
+            if attempt > retry_times:
+                await asyncio.sleep(BaseMessage._backoff(attempt))
+            responses = await BaseMessage._exchange_async(pending, connection)
+            failed = []
+            for (message, frames), response in zip(pending, responses):
+                error_reason = message._check_response(response)
+                if len(error_reason) > 0:
+                    message._warn_retry(attempt, error_reason)
+                    failed.append((message, frames, error_reason))
+            if not failed:
+                return
+            pending = [(message, frames) for message, frames, _ in failed]
+        for message, _, error_reason in failed:
+            message._give_up(error_reason)
+
+    @staticmethod
+    async def _exchange_async(
+        pending: List[Tuple["BaseMessage", List[memoryview]]],
+        connection: "_AsyncConnection" = None
+    ) -> List[Union["ResponseMessage", Exception]]:
+        """ The async counterpart of `_exchange`, for messages to the
+        same server
+
+        Return
+        ------
+        the response to each message, or the error the connection
+        failed with
+        """
+        address = (pending[0][0].ip, pending[0][0].port)
+        pooled = connection is None
+        while True:
+            if pooled:
+                connection = BaseMessage._async_pool.acquire(address)
+            reused = connection.is_open
+            responses = [
+                frames if isinstance(frames, Exception) else ResponseMessage.from_bytes(frames[0])
+                for frames in await connection.exchange([frames for _, frames in pending])
+            ]
+            if reused and isinstance(responses[0], Exception):
+                # a kept connection is found broken, see `_exchange`
+                if pooled:
+                    BaseMessage._async_pool.clear(address)
+                continue
+            if any(len(message._check_response(response)) > 0 for (message, _), response in zip(pending, responses)):
+                # the connection might be out of sync, drop it
+                connection.close()
+            if pooled:
+                BaseMessage._async_pool.release(connection)
+            return responses
+
     @classmethod
-    def unpack(cls, bstring) -> Tuple["BaseMessage", str]:
+    def unpack(cls, bstring, buffers = ()) -> Tuple["BaseMessage", str]:
         """ Construct the message object from binary pickled string
         which is expected to be received from sockets.
 
         Params
         ------
         bstring: the binary pickled string reaad from sockets
+        buffers: the out-of-band buffers received along with the
+            pickled string
 
         Returns
         -------
@@ -114,7 +603,7 @@ class BaseMessage(ABC):
         cannot be constructed. 
         """
         try:
-            msg = pickle.loads(bstring)
+            msg = pickle.loads(bstring, buffers=buffers)
             if isinstance(msg, BaseMessage):
                 err = ""
             else:
@@ -131,64 +620,86 @@ class ResponseMessage(BaseMessage):
     ------
     message_idx: the idx of the request message
     err_msg: error message, empty if no error
+
+    Sent for every request, the response is not pickled but packed
+    by hand as the 8-byte message idx followed by the UTF-8 encoded
+    error message
     """
+    _fields = BaseMessage._fields + ('err_msg',)
+    _idx_struct = struct.Struct('!Q')
+
     def __init__(self, message_idx: int, err_msg: str) -> None:
         self.message_idx = message_idx
         self.err_msg = err_msg
 
+    def to_bytes(self) -> bytes:
+        return ResponseMessage._idx_struct.pack(self.message_idx) + self.err_msg.encode()
+
+    @classmethod
+    def from_bytes(cls, frame: ByteString) -> "ResponseMessage":
+        """ Parse the bytes packed by `to_bytes`
+
+        Return
+        ------
+        The response, or None if the bytes are too short to be one
+        """
+        if len(frame) < cls._idx_struct.size:
+            return None
+        message_idx, = cls._idx_struct.unpack_from(frame)
+        return cls(message_idx, bytes(frame[cls._idx_struct.size:]).decode(errors='replace'))
+
 class MeshesMessage(BaseMessage):
     """
     Params
     ------
     mesh_name: name of the mesh files, together with the extension suffix
     mesh_file: the content of the mesh file
-    init_pose: an 4-by-4 np.ndarray, describing the initial pose of the mesh
+    init_pose: an 4-by-4 np.ndarray, describing the initial pose of the mesh,
+        sent as float32
+    compress: whether to compress the file content (zlib, level 1)
+        before sending it; off by default, since over the loopback the
+        compression takes far longer than sending the file as it is,
+        only worth it when the server is reached over a slow network
     """
-    def __init__(self, mesh_name: str, mesh_file:ByteString, init_pose: np.ndarray) -> None:
+    _fields = BaseMessage._fields + ('mesh_name', 'init_pose', 'compression', 'mesh_file_bytes')
+    CRITICAL = True
+
+    def __init__(self, mesh_name: str, mesh_file:ByteString, init_pose: np.ndarray, compress: bool = False) -> None:
         super().__init__()
         self.mesh_name = mesh_name
-        self.init_pose = init_pose
-
-        self.chunks = []
-        self._split_file_content_to_chunks(mesh_file)
-        self.chunk_num = len(self.chunks)
-
-    CHUNK_SIZE = 61440 # 60KB
-    class Chunk(BaseMessage):
-        def __init__(self, mesh_name:str, chunk_id: int, chunk) -> None:
-            super().__init__()
-            self.mesh_name = mesh_name
-            self.chunk_id = chunk_id
-            self.chunk = chunk
-
-
-    def _split_file_content_to_chunks(self, bstr: ByteString) -> List[Chunk]:
-        sent_size = 0
-        chunks = []
-        total_size = len(bstr)
-        while sent_size < total_size:
-            self.chunks.append(self.Chunk(
-                self.mesh_name,
-                len(chunks),
-                bstr[sent_size: min(sent_size + MeshesMessage.CHUNK_SIZE, total_size)]
-            ))
-            sent_size = min(sent_size + MeshesMessage.CHUNK_SIZE, total_size)
-
-    def send(self, retry_times=0):
-        chunks = self.chunks
-        self.chunks = []
-        super().send(retry_times)
-        
-        for chunk in chunks:
-            chunk.send(retry_times)
-        self.chunks = chunks
+        self.init_pose = init_pose if init_pose is None else \
+            np.ascontiguousarray(init_pose, dtype=np.float32)
 
-    @property
+        self.compression = None
+        """ how `mesh_file_bytes` is compressed, None if not compressed
+        """
+        if compress:
+            mesh_file = zlib.compress(mesh_file, 1)
+            self.compression = 'zlib'
+        self.mesh_file_bytes = mesh_file
+        """ the file content as it is sent
+        """
+
+    def _field_state(self, field: str, protocol: int) -> Any:
+        if field == 'mesh_file_bytes':
+            # wrapped in a PickleBuffer, the file content goes out-of-band
+            # rather than being copied into the pickle stream, which older
+            # protocols (and copy.deepcopy) do not support
+            if protocol >= 5:
+                return pickle.PickleBuffer(self.mesh_file_bytes)
+            return bytes(self.mesh_file_bytes)
+        return super()._field_state(field, protocol)
+
+    @cached_property
     def mesh_file(self) -> ByteString:
-        bstr = b''
-        for chunk in self.chunks:
-            bstr += chunk.chunk
-        return bstr
+        """ The file content, decompressed if needed. It is decompressed
+        once, on the first access
+        """
+        if self.compression == 'zlib':
+            return zlib.decompress(self.mesh_file_bytes)
+        # received out-of-band, `mesh_file_bytes` is a view of the
+        # receive buffer rather than bytes
+        return bytes(self.mesh_file_bytes)
     
 class AddRigidBodyPrimitiveMessage(BaseMessage):
     """
@@ -198,6 +709,14 @@ class AddRigidBodyPrimitiveMessage(BaseMessage):
     typename_in_bpy: the corresponding typename in the BPY
     params: the keyword parameters to create the primitive in the BPY
     """
+    _fields = BaseMessage._fields + ('primitive_name', 'primitive_type', 'params')
+    CRITICAL = True
+    _primitive_ctors: Dict[str, Callable[..., Any]] = {}
+    """ primitive_type -> the BPY operator creating it, filled by the
+    first `create_primitive_in_blender`, as `bpy` is only available
+    inside the Blender
+    """
+
     def __init__(self, primitive_name:str, typename_in_bpy: str, **params: Any) -> None:
         super().__init__()
         self.primitive_name = primitive_name
@@ -207,7 +726,26 @@ class AddRigidBodyPrimitiveMessage(BaseMessage):
     def create_primitive_in_blender(self):
         """ create the primitive in BPY
         """
-        return eval(self.primitive_type)(**self.params)
+        ctors = AddRigidBodyPrimitiveMessage._primitive_ctors
+        if not ctors:
+            import bpy
+            ctors.update({
+                f"bpy.ops.mesh.{op}": getattr(bpy.ops.mesh, op) for op in (
+                    "primitive_cube_add",
+                    "primitive_uv_sphere_add",
+                    "primitive_ico_sphere_add",
+                    "primitive_cylinder_add",
+                    "primitive_cone_add",
+                    "primitive_torus_add",
+                    "primitive_plane_add",
+                    "primitive_circle_add",
+                    "primitive_grid_add",
+                    "primitive_monkey_add",
+                )
+            })
+        if self.primitive_type not in ctors:
+            raise ValueError(f"unknown primitive type {self.primitive_type}")
+        return ctors[self.primitive_type](**self.params)
 
 class CollisionMessage(BaseMessage):
     """The message marks a collision
@@ -221,6 +759,8 @@ class CollisionMessage(BaseMessage):
     bodies: list of object names
     frame_idx: the frame index of this event
     """
+    _fields = BaseMessage._fields + ('bodies', 'frame_idx')
+
     def __init__(self, bodies: List[str], frame_idx: int) -> None:
         super().__init__()
         self.bodies = bodies
@@ -237,12 +777,14 @@ class DeformableMeshesMessage(BaseMessage):
     ------
     name: the object name
     frame_idx: the frame index at which the deformation is in effect
-    particles: a (N, 3) array storing meshes vertices
+    particles: a (N, 3) array storing meshes vertices, sent as float32
     faces: a (M, 3) array, where each row is the vertex indices of one
-        triangle face in this meshes
+        triangle face in this meshes, sent as int32
     """
+    _fields = BaseMessage._fields + ('obj_name', 'frame_idx', 'prev_frame_idx', 'particles', 'faces')
+    CRITICAL = True
     _name_2_frame_idx: Dict[str, int] = {}
-    _frame_lock = threading.RLock()
+    _frame_lock = threading.Lock()
 
     def __init__(self, name: str, frame_idx: int, particles: np.ndarray, faces: np.ndarray) -> None:
         super().__init__()
@@ -253,8 +795,9 @@ class DeformableMeshesMessage(BaseMessage):
         of the same object
         """
         self._update_frame_index()
-        self.particles = particles
-        self.faces = faces
+        # single precision is plenty for rendering, and halves the bytes sent
+        self.particles = np.ascontiguousarray(particles, dtype=np.float32)
+        self.faces = np.ascontiguousarray(faces, dtype=np.int32)
 
 
     def _update_frame_index(self) -> None:
@@ -262,18 +805,9 @@ class DeformableMeshesMessage(BaseMessage):
 
         This is thread-safe. 
         """
-        DeformableMeshesMessage._frame_lock.acquire()
-        try:
+        with DeformableMeshesMessage._frame_lock:
             self.prev_frame_idx = DeformableMeshesMessage._name_2_frame_idx.get(self.obj_name, None)
             DeformableMeshesMessage._name_2_frame_idx[self.obj_name] = self.frame_idx
-        finally:
-            DeformableMeshesMessage._frame_lock.release()
-
-    def send(self, retry_times=0):
-        # NOTE: the message will be wrapped in a MeshesMessage to send. You
-        # may refer to the README regarding why it is designed in this way
-        wrap_msg = MeshesMessage(f"MPM::MESHES::{self.obj_name}::{self.frame_idx}", pickle.dumps(self), None)
-        return wrap_msg.send(retry_times)
 
     class Factory:
         """ Factory of DeformableMeshesMessage, used to re-construct the
@@ -292,6 +826,25 @@ class DeformableMeshesMessage(BaseMessage):
             Therefore, the scale should be set as (256, 256, 256). 
         NOTE: either `pcd` or `sdf`, not both, not neither
         """
+        _alpha_cache: Dict[str, Tuple[int, np.ndarray, float]] = {}
+        """ object name -> (frame idx, bounding box extent, alpha of the
+        alpha shape) when the alpha was computed
+        """
+        ALPHA_SPACING_RATIO = 4
+        """ the alpha of the alpha shape over the mean particle spacing;
+        smaller ratios leave squashed objects not watertight, larger
+        ones start to fill in gaps narrower than about 6 particles
+        """
+        ALPHA_REFRESH_FRAMES = 10
+        """ the cached alpha of an object is re-computed at least once
+        every this many frames
+        """
+        ALPHA_TOLERANCE = 0.1
+        """ the cached alpha of an object is also re-computed once the
+        extent of its bounding box changes by more than this ratio
+        along any axis, e.g. when it is squashed or stretched
+        """
+
         def __init__(self, name: str, frame_idx: int, sdf = None, pcd = None, scale = (1, 1, 1)) -> None:
             self.name = name
             self.frame_idx = frame_idx
@@ -304,18 +857,27 @@ class DeformableMeshesMessage(BaseMessage):
             self.scale = np.array(scale)
         
         @classmethod
-        def _face_reconstruction(cls, pcd: np.ndarray) -> o3d.geometry.TriangleMesh:
-            # step 1: build a o3d pcd
-            vertices = o3d.utility.Vector3dVector(pcd.reshape((-1, 3)))
-            point_cloud = o3d.geometry.PointCloud(vertices)
-            point_cloud.estimate_normals()
-            # step 2: average the distance to get the radius
-            distances = point_cloud.compute_nearest_neighbor_distance()
-            radius = np.mean(distances) * 1.5
-            meshes = o3d.geometry.TriangleMesh.create_from_point_cloud_ball_pivoting(
-                point_cloud, 
-                o3d.utility.DoubleVector([radius, radius * 2])
-            )
+        def _face_reconstruction(cls, name: str, frame_idx: int, pcd: np.ndarray) -> o3d.geometry.TriangleMesh:
+            # step 1: build a o3d pcd, float64 and contiguous so that
+            # open3d takes the fast path to copy the points
+            points = np.ascontiguousarray(pcd, dtype=np.float64).reshape((-1, 3))
+            point_cloud = o3d.geometry.PointCloud(o3d.utility.Vector3dVector(points))
+            # step 2: average the distance to get the alpha, which barely
+            # changes from one frame to the next, so it is only re-computed
+            # every few frames, or once the object is deformed noticeably
+            extent = np.ptp(points, axis=0)
+            cached = cls._alpha_cache.get(name)
+            if cached is None or \
+                not 0 <= frame_idx - cached[0] < cls.ALPHA_REFRESH_FRAMES or \
+                np.any(np.abs(extent - cached[1]) > cls.ALPHA_TOLERANCE * cached[1]):
+                distances = point_cloud.compute_nearest_neighbor_distance()
+                alpha = np.mean(distances) * cls.ALPHA_SPACING_RATIO
+                cls._alpha_cache[name] = (frame_idx, extent, alpha)
+            else:
+                alpha = cached[2]
+            # unlike ball pivoting, the alpha shape needs no normals, and
+            # covers the whole outer surface of a cloud filling a volume
+            meshes = o3d.geometry.TriangleMesh.create_from_point_cloud_alpha_shape(point_cloud, alpha)
             return meshes
         
         @classmethod
@@ -326,8 +888,8 @@ class DeformableMeshesMessage(BaseMessage):
         def message(self) -> "DeformableMeshesMessage":
             """ Generate the meshes and wrap it into a DeformableMeshesMessage
 
-            If `pcd` is set, the meshes will be re-constructed using ball
-            pivoting; otherwise, when the `sdf` is set, marching cube
+            If `pcd` is set, the meshes will be re-constructed as an alpha
+            shape; otherwise, when the `sdf` is set, marching cube
             method will be used to re-construct the meshes
 
             Return
@@ -335,32 +897,45 @@ class DeformableMeshesMessage(BaseMessage):
             The generated DeformableMeshesMessage
             """
             if self.pcd is not None:
-                o3d_mesh = DeformableMeshesMessage.Factory._face_reconstruction(self.pcd)
+                o3d_mesh = DeformableMeshesMessage.Factory._face_reconstruction(self.name, self.frame_idx, self.pcd)
                 np_particles = np.asarray(o3d_mesh.vertices)
                 np_faces = np.asarray(o3d_mesh.triangles)
             else:
                 np_particles, np_faces = DeformableMeshesMessage.Factory._marching_cube(self.sdf)
                 np_particles /= self.scale
-            particles = [np_particles[i, :] for i in range(np_particles.shape[0])]
-            faces = [np_faces[i, :] for i in range(np_faces.shape[0])]
-            return DeformableMeshesMessage(self.name, self.frame_idx, particles, faces)
+            return DeformableMeshesMessage(self.name, self.frame_idx, np_particles, np_faces)
 
 class UpdateRigidBodyPoseMessage(BaseMessage):
     """
     Params
     ------
     name: identifier of the rigid-body object to be updated
-    pose: the new pose vector of dim 7
+    pose: the new pose vector of dim 7, sent as float32
     frame_idx: the frame idx at which the update is in effect
     """
+    _fields = BaseMessage._fields + ('name', 'pose_vec', 'frame_idx')
+
     def __init__(self, name: str, pose: Union[np.ndarray, List[float]], frame_idx: int) -> None:
         super().__init__()
-        assert len(pose) == 7, \
-            f"the pose of a mesh is expected to be a 7-dim vector, but got a {pose}"
+        pose = np.ascontiguousarray(pose, dtype=np.float32)
+        if pose.size != 7:
+            raise ValueError(f"the pose of a mesh is expected to be a 7-dim vector, but got a {pose}")
         self.name = name
-        self.pose_vec = pose
+        self.pose_vec = pose.reshape(7)
         self.frame_idx = frame_idx
 
+    def _field_state(self, field: str, protocol: int) -> Any:
+        if field == 'pose_vec':
+            # sent for every object in every frame, the 7 numbers are much
+            # cheaper to pickle as packed float32 than as an array, which
+            # costs a NumPy reconstructor and an extra out-of-band frame
+            return struct.pack('!7f', *self.pose_vec)
+        return super()._field_state(field, protocol)
+
+    def __setstate__(self, state: Tuple[Any, ...]) -> None:
+        super().__setstate__(state)
+        self.pose_vec = np.array(struct.unpack('!7f', self.pose_vec), dtype=np.float32)
+
 class FinishAnimationMessage(BaseMessage):
     """The message marks the end of animation
 
@@ -373,7 +948,31 @@ class FinishAnimationMessage(BaseMessage):
         by the renderer as the file saving name
     end_frame_idx: the end frame index of the animation
     """
+    _fields = BaseMessage._fields + ('exp_name', 'end_frame_idx')
+
     def __init__(self, exp_name: str, end_frame_idx: int) -> None:
         super().__init__()
         self.end_frame_idx = end_frame_idx
         self.exp_name = exp_name
+
+
+# The message classes are registered as pickle extensions, so that a pickled
+# message refers to its class by a 1-byte code (the EXT1 opcode) instead of
+# by its module and class names. The codes are from the range reserved for
+# private use (240 - 255) and are part of the protocol: only append to this.
+for _code, _message_type in (
+    (240, ResponseMessage),
+    (241, MeshesMessage),
+    # 242 was MeshesMessage.Chunk, retired
+    (243, AddRigidBodyPrimitiveMessage),
+    (244, CollisionMessage),
+    (245, DeformableMeshesMessage),
+    (246, UpdateRigidBodyPoseMessage),
+    (247, FinishAnimationMessage),
+):
+    try:
+        copyreg.add_extension(_message_type.__module__, _message_type.__qualname__, _code)
+    except ValueError:
+        # the code is taken, e.g. by this module imported under another name;
+        # the class is then pickled by its names as usual
+        pass
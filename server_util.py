@@ -1,70 +1,142 @@
 import asyncio
-from chunk import Chunk
 from datetime import datetime
-import pickle
-from typing import Callable, Dict
+import struct
+import traceback
+from typing import Callable, List, Tuple
 import numpy as np
 
 import open3d as o3d
 
-from .message import BaseMessage, ResponseMessage, MeshesMessage, DeformableMeshesMessage
+from .message import BaseMessage, ResponseMessage
 
 class MeshChunksHandler:
-    """ A middleware to merge chunks into its MeshesMessage
+    """ A middleware kept for compatibility. The DeformableMeshesMessage
+    used to be wrapped in a MeshesMessage to send, but it is now sent
+    as it is, so every message is passed to the next handler directly
 
     Params
     ------
-    next_handler: the method to deal with the reconstructed fully-
-        received AddRigidBodyMeshMessage, or other messages 
+    next_handler: the method to deal with the messages
     """
     def __init__(self, next_handler: Callable[[BaseMessage], None]):
-        self.mesh_name_2_msg:    Dict[str, MeshesMessage] = {}
-        self.mesh_name_2_chunks: Dict[str, Chunk] = {}
         self.handler = next_handler
     
     def __call__(self, msg: BaseMessage):
-        if isinstance(msg, MeshesMessage):
-            self.mesh_name_2_msg[msg.mesh_name] = msg
-        elif isinstance(msg, MeshesMessage.Chunk):
-            name = msg.mesh_name
-            if name not in self.mesh_name_2_chunks:
-                self.mesh_name_2_chunks[name] = [msg]
-            else:
-                self.mesh_name_2_chunks[name].append(msg)
-            # check whether all the chunks has been collected
-            if name in self.mesh_name_2_msg and \
-                len(self.mesh_name_2_chunks[name]) == self.mesh_name_2_msg[name].chunk_num:
-                self.mesh_name_2_chunks[name].sort(key = lambda x: x.chunk_id)
-                meshmsg = self.mesh_name_2_msg[name]
-                for chunk in self.mesh_name_2_chunks[name]:
-                    meshmsg.chunks.append(chunk)
-                del self.mesh_name_2_chunks[name]
-                del self.mesh_name_2_msg[name]
-                if name.startswith("MPM::MESHES::"):
-                    # a open3d re-constructed meshes from point cloud
-                    pcdMessage: DeformableMeshesMessage = pickle.loads(meshmsg.mesh_file)
-                    self.handler(pcdMessage)
-                else:
-                    # a nomal meshes
-                    self.handler(meshmsg)
-        else:
-            self.handler(msg)
+        self.handler(msg)
+
+class _RequestProtocol(asyncio.BufferedProtocol):
+    """ Reads the requests of one connection in place, i.e. the
+    event loop receives the bytes straight into the buffers below
+    rather than into a stream buffer they are later copied out of
+
+    Small requests are read, several at a time, into a staging
+    buffer. Once the header of a request is in, the request gets a
+    bytearray of its own, into which the rest of it is received
+    directly. The message is unpickled from that bytearray, so the
+    arrays in it stay valid, and writable, after the next request.
+
+    Params
+    ------
+    server: the server the requests are passed to
+    """
+    STAGING_BUFFER_SIZE = 65536 # 64KB, only headers and small requests
+
+    def __init__(self, server: "AsyncServer") -> None:
+        self.server = server
+        self.transport: asyncio.Transport = None
+        self._staging = bytearray(_RequestProtocol.STAGING_BUFFER_SIZE)
+        self._start = 0
+        """ the first byte in `_staging` not consumed yet
+        """
+        self._end = 0
+        """ the end of the bytes received into `_staging`
+        """
+        self._frame_lens: Tuple[int, ...] = ()
+        self._body: memoryview = None
+        """ the buffer the request being received is read into,
+        None when reading into `_staging`
+        """
+        self._body_received = 0
+
+    def connection_made(self, transport: asyncio.Transport) -> None:
+        self.transport = transport
+
+    def connection_lost(self, exc) -> None:
+        # closed by the client, or dropped after a failed attempt
+        self.server.logger(f"connection terminated")
+
+    def get_buffer(self, sizehint: int) -> memoryview:
+        if self._body is not None:
+            return self._body[self._body_received:]
+        if self._start:
+            # only a part of the next header can be left over
+            remaining = self._end - self._start
+            self._staging[:remaining] = self._staging[self._start:self._end]
+            self._start, self._end = 0, remaining
+        if self._end == len(self._staging):
+            # a header of more frames than the staging buffer holds
+            self._staging = self._staging + bytearray(len(self._staging))
+        return memoryview(self._staging)[self._end:]
+
+    def buffer_updated(self, nbytes: int) -> None:
+        if self._body is not None:
+            self._body_received += nbytes
+            if self._body_received == len(self._body):
+                body, self._body = self._body, None
+                self._serve(body)
+            return
+        self._end += nbytes
+        while self._take_request():
+            pass
+
+    def _take_request(self) -> bool:
+        """ Take the next request out of `_staging`
+
+        Return
+        ------
+        True if a whole request was taken and served, False if more
+        bytes are needed
+        """
+        # the request is framed as: the number of frames, the length
+        # of each frame, then the pickled message followed by its
+        # out-of-band buffers (see BaseMessage.send)
+        available = self._end - self._start
+        if available < 4:
+            return False
+        frame_num, = struct.unpack_from('!I', self._staging, self._start)
+        header_len = 4 + 8 * frame_num
+        if available < header_len:
+            return False
+        self._frame_lens = struct.unpack_from(f'!{frame_num}Q', self._staging, self._start + 4)
+        body = memoryview(bytearray(sum(self._frame_lens)))
+        begin = self._start + header_len
+        received = min(available - header_len, len(body))
+        body[:received] = memoryview(self._staging)[begin:begin + received]
+        self._start = begin + received
+        if received < len(body):
+            self._body, self._body_received = body, received
+            return False
+        self._serve(body)
+        return True
+
+    def _serve(self, body: memoryview) -> None:
+        frames, offset = [], 0
+        for frame_len in self._frame_lens:
+            frames.append(body[offset:offset + frame_len])
+            offset += frame_len
+        self.server._handle_incoming_request(frames, self.transport)
 
 class AsyncServer:
     """ An async server
     Params
     ------
     message_handler: a callback to hangle the incoming message
-        
-    **NOTE** You don't need to care about the chunks of a mesh
-    file, because the above middleware will merge the chunks into
-    one AddMeshMessageHandler
     """
     def __init__(self, message_handler: Callable[[BaseMessage], None], logger:Callable[[str], None] = None) -> None:
-        self.message_handler = MeshChunksHandler(message_handler)
+        self.message_handler = message_handler
         self.logger = logger if logger else (lambda s: print('[DEBUG]', datetime.now(), s))
 
-    async def _handle_incoming_request(self, reader: asyncio.StreamReader, writer):
+    def _handle_incoming_request(self, frames: List[memoryview], transport: asyncio.Transport):
         """ When there is request coming from the client, the
         method retrieve the message object from the request,
         verify the message, respond to the client and finally
@@ -73,29 +145,29 @@ class AsyncServer:
 
         Params
         ------
-        reader: from which the request is to be read
-        writer: to which the response will be written
+        frames: the frames the request is made up of
+        transport: to which the response will be written
         """
-        bstr, done = b'', False
-        while not done:
-            line = await reader.read(1024)
-            bstr += line
-            done = len(line) < 1024
-        
-        self.logger(f"{len(bstr)} bytes are read")
-        request, err = BaseMessage.unpack(bstr)
-        self.logger(f"No.{request.message_idx if request != None else 'Unknow'} message of type {type(request)} is decoded with error: {err}, preparing response")
-        if request != None:
-            response = ResponseMessage(request.message_idx, err)
-        else:
-            response = ResponseMessage(0, err)
-        writer.write(pickle.dumps(response))
-        await writer.drain()
-        self.logger(f"No.{request.message_idx if request != None else 'Unknow'} message's response has been sent")
-        writer.close()
-        self.logger(f"connection terminated")
+        self.logger(f"{sum(frame.nbytes for frame in frames)} bytes are read")
+        try:
+            request, err = BaseMessage.unpack(frames[0], frames[1:])
+        except Exception as e:
+            # e.g. the state of a message does not match its class
+            request, err = None, f"the message cannot be unpickled: {e!r}"
+        request_idx = request.message_idx if isinstance(request, BaseMessage) else 'Unknow'
+        self.logger(f"No.{request_idx} message of type {type(request)} is decoded with error: {err}, preparing response")
+        response = ResponseMessage(request_idx if isinstance(request_idx, int) else 0, err)
+        # framed in the same way, as one frame
+        bstr = response.to_bytes()
+        transport.write(struct.pack('!IQ', 1, len(bstr)) + bstr)
+        self.logger(f"No.{request_idx} message's response has been sent")
         if not err:
-            self.message_handler(request)
+            try:
+                self.message_handler(request)
+            except Exception:
+                # a failing handler must not drop the connection, which
+                # is kept for the following messages
+                self.logger(f"No.{request_idx} message failed to be handled:\n{traceback.format_exc()}")
 
     async def run_server(self):
         """ Start the server
@@ -104,8 +176,10 @@ class AsyncServer:
         to start.
         """
         self.logger(f"starting server at 127.0.0.1:{BaseMessage.port}")
-        server = await asyncio.start_server(
-            self._handle_incoming_request,
+        # the client keeps the connection open across messages, so the
+        # requests are served one after another until it is closed
+        server = await asyncio.get_running_loop().create_server(
+            lambda: _RequestProtocol(self),
             '127.0.0.1',
             BaseMessage.port
         )